@@ -22,8 +22,11 @@ import io
 import re
 import time
 import asyncio
+import functools
+import heapq
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Sequence, Tuple, Optional
 
 import aiosqlite
 import pytz
@@ -36,7 +39,7 @@ from discord import app_commands
 
 from TikTokLive import TikTokLiveClient
 from TikTokLive.events import GiftEvent, LiveEndEvent, CommentEvent, ConnectEvent, LikeEvent
-from aiohttp import web, ClientSession, ClientTimeout
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
 
 # ------------------- Config -------------------
 load_dotenv()
@@ -56,8 +59,21 @@ POST_LIVE_MESSAGE = os.getenv(
     "🎬 **Creators Connections — Live Recap**\nLeft: Top Gifters • Right: Top Tappers"
 )
 DEBUG_TIKTOK = os.getenv("DEBUG_TIKTOK", "false").lower() == "true"
+# How often in-progress live tallies are persisted (seconds)
+TALLY_FLUSH_SECONDS = int(os.getenv("TALLY_FLUSH_SECONDS", "10"))
+# Leaderboard image encoding: "webp" (default, smaller + faster) or "png"
+LEADERBOARD_FORMAT = os.getenv("LEADERBOARD_FORMAT", "webp").lower()
+if LEADERBOARD_FORMAT not in ("webp", "png", "jpeg"):
+    LEADERBOARD_FORMAT = "webp"
 TIKTOK_SESSIONID = os.getenv("TIKTOK_SESSIONID", "").strip()
 
+# TikTok handles in chat: "@name" or "tiktok.com/@name"
+# Each branch starts on a literal; the lookbehind is the old \B@ test (no word character right before the @).
+HANDLE_RE = re.compile(r"tiktok\.com/@([A-Za-z0-9._-]{2,24})|(?<!\w)@([A-Za-z0-9._-]{2,24})")
+
+# Names shown per column on the leaderboard image
+LEADERBOARD_ROWS = 10
+
 # XP / Ranks
 DEFAULT_XP_PER_GIFT = int(os.getenv("DEFAULT_XP_PER_GIFT", "100"))
 RANKS = [
@@ -72,11 +88,30 @@ RANKS = [
 ]
 
 # ------------------- Utility -------------------
+@functools.lru_cache(maxsize=64)
+def _tz(name: str):
+    return pytz.timezone(name)
+
 def now_tz(tz_name: str = DEFAULT_TZ) -> datetime:
-    return datetime.now(pytz.timezone(tz_name))
+    return datetime.now(_tz(tz_name))
+
+# One long-lived connection for the whole process (opened by ensure_db in setup_hook, closed in bot.close).
+# Writers hold DB_LOCK across their execute/commit batch so transactions don't interleave.
+DB: Optional[aiosqlite.Connection] = None
+DB_LOCK = asyncio.Lock()
 
 async def ensure_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    global DB
+    if DB is None:
+        DB = await aiosqlite.connect(DB_PATH)
+        await DB.execute("PRAGMA journal_mode=WAL")
+        await DB.execute("PRAGMA synchronous=NORMAL")
+        await DB.execute("PRAGMA temp_store=MEMORY")
+        await DB.execute("PRAGMA cache_size=-64000")
+        await DB.execute("PRAGMA mmap_size=268435456")
+        await DB.execute("PRAGMA busy_timeout=5000")
+    async with DB_LOCK:
+        db = DB
         await db.execute("""
             CREATE TABLE IF NOT EXISTS guild_config (
                 guild_id INTEGER PRIMARY KEY,
@@ -146,31 +181,67 @@ async def ensure_db():
                 PRIMARY KEY (guild_id, yyyymm)
             );
         """)
+        # Sessions still open here belong to a previous process that stopped without a LiveEndEvent.
+        # Close them at their start so their flushed rows count only in the week they began.
+        await db.execute("UPDATE live_session SET ended_at=started_at WHERE ended_at IS NULL;")
+        # link_map lookups are already served by its (guild_id, tiktok_username) primary key index.
+        # Weekly lists: the session window index answers the overlap filter, and the covering
+        # (session_id, tiktok_user, count) indexes let SUM(count) ... GROUP BY read only the index.
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_session_window ON live_session(guild_id, started_at, ended_at);")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_gift_session ON live_gift(session_id, tiktok_user, count);")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_like_session ON live_like(session_id, tiktok_user, count);")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_comment_sid ON live_comment(session_id);")
         await db.commit()
+        # refreshes planner statistics only where they're missing or stale (cheap no-op otherwise)
+        await db.execute("PRAGMA optimize;")
+
+# Guild config only changes through upsert_guild_cfg, which writes through to this cache.
+# Per-guild locks make concurrent misses share one SELECT instead of each filling the cache.
+_CFG_CACHE: Dict[int, dict] = {}
+_CFG_LOCKS: Dict[int, asyncio.Lock] = {}
+
+def _cfg_from_row(row) -> dict:
+    return {
+        "tiktok_username": row[0],
+        "channel_id": row[1],
+        "top_role_id": row[2],
+        "timezone": row[3] or DEFAULT_TZ,
+        "weekly_day": row[4] or 6,
+        "weekly_hour": row[5] or 19,
+        "weekly_minute": row[6] or 0,
+    }
 
 async def get_guild_cfg(guild_id: int) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT tiktok_username, channel_id, top_role_id, timezone, weekly_day, weekly_hour, weekly_minute
-            FROM guild_config WHERE guild_id=?
-        """, (guild_id,)) as cur:
-            row = await cur.fetchone()
-            if not row:
-                return {}
-            return {
-                "tiktok_username": row[0],
-                "channel_id": row[1],
-                "top_role_id": row[2],
-                "timezone": row[3] or DEFAULT_TZ,
-                "weekly_day": row[4] or 6,
-                "weekly_hour": row[5] or 19,
-                "weekly_minute": row[6] or 0,
-            }
+    cfg = _CFG_CACHE.get(guild_id)
+    if cfg is None:
+        async with _CFG_LOCKS.setdefault(guild_id, asyncio.Lock()):
+            cfg = _CFG_CACHE.get(guild_id)
+            if cfg is None:
+                db = DB
+                async with db.execute("""
+                    SELECT tiktok_username, channel_id, top_role_id, timezone, weekly_day, weekly_hour, weekly_minute
+                    FROM guild_config WHERE guild_id=?
+                """, (guild_id,)) as cur:
+                    row = await cur.fetchone()
+                cfg = _cfg_from_row(row) if row else {}
+                _CFG_CACHE[guild_id] = cfg
+    return dict(cfg)
 
 async def upsert_guild_cfg(guild_id: int, **kwargs):
-    cfg = await get_guild_cfg(guild_id)
-    cfg.update(kwargs)
-    async with aiosqlite.connect(DB_PATH) as db:
+    # read-merge-write under DB_LOCK so back-to-back background updates can't drop each other's fields
+    async with DB_LOCK:
+        cfg = await get_guild_cfg(guild_id)
+        cfg.update(kwargs)
+        values = (
+            cfg.get("tiktok_username"),
+            cfg.get("channel_id"),
+            cfg.get("top_role_id"),
+            cfg.get("timezone", DEFAULT_TZ),
+            cfg.get("weekly_day", 6),
+            cfg.get("weekly_hour", 19),
+            cfg.get("weekly_minute", 0),
+        )
+        db = DB
         await db.execute("""
             INSERT INTO guild_config (guild_id, tiktok_username, channel_id, top_role_id, timezone, weekly_day, weekly_hour, weekly_minute)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -182,17 +253,25 @@ async def upsert_guild_cfg(guild_id: int, **kwargs):
               weekly_day=excluded.weekly_day,
               weekly_hour=excluded.weekly_hour,
               weekly_minute=excluded.weekly_minute;
-        """, (
-            guild_id,
-            cfg.get("tiktok_username"),
-            cfg.get("channel_id"),
-            cfg.get("top_role_id"),
-            cfg.get("timezone", DEFAULT_TZ),
-            cfg.get("weekly_day", 6),
-            cfg.get("weekly_hour", 19),
-            cfg.get("weekly_minute", 0),
-        ))
+        """, (guild_id, *values))
         await db.commit()
+        _CFG_CACHE[guild_id] = _cfg_from_row(values)
+    _schedule_changed.set()
+
+_background_tasks: set = set()
+
+def run_in_background(coro, what: str):
+    """Fire-and-forget with a strong reference kept until done; failures are printed instead of lost."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+
+    def _done(t: asyncio.Task):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception():
+            print(f"{what} failed: {t.exception()}")
+
+    task.add_done_callback(_done)
+    return task
 
 def yyyymm(dt: datetime) -> str:
     return dt.strftime("%Y%m")
@@ -200,45 +279,103 @@ def yyyymm(dt: datetime) -> str:
 # ------------------- Discord Setup -------------------
 intents = discord.Intents.default()
 intents.members = True
-bot = discord.Client(intents=intents)
+
+class CreatorConnectionsBot(discord.Client):
+    async def setup_hook(self):
+        # runs before any event or interaction is dispatched, so DB is always open for handlers
+        await ensure_db()
+
+    async def close(self):
+        global DB
+        if _HTTP_SESSION is not None and not _HTTP_SESSION.closed:
+            await _HTTP_SESSION.close()
+        # aiosqlite's worker thread is non-daemon: an open connection would keep the process alive after run()
+        async with DB_LOCK:  # let an in-flight flush finish first
+            if DB is not None:
+                await DB.close()
+                DB = None
+        await super().close()
+
+bot = CreatorConnectionsBot(intents=intents)
 tree = app_commands.CommandTree(bot)
 
 running_clients: Dict[int, TikTokLiveClient] = {}
 current_session_id: Dict[int, int] = {}
-live_gifters: Dict[int, Dict[str, int]] = {}
-live_commenters: Dict[int, Dict[str, int]] = {}
-live_likers: Dict[int, Dict[str, int]] = {}
+live_gifters: Dict[int, Counter[str]] = {}
+live_commenters: Dict[int, Counter[str]] = {}
+live_likers: Dict[int, Counter[str]] = {}
+# Share of each live tally already written to the live_* tables by flush_live_tallies
+flushed_gifters: Dict[int, Counter[str]] = {}
+flushed_commenters: Dict[int, Counter[str]] = {}
+flushed_likers: Dict[int, Counter[str]] = {}
+_TALLY_TABLES = (
+    ("live_gift", live_gifters, flushed_gifters),
+    ("live_comment", live_commenters, flushed_commenters),
+    ("live_like", live_likers, flushed_likers),
+)
+# Gift XP per TikTok user not yet written to user_xp; applied by flush_pending_xp
+pending_xp: Dict[int, Counter[str]] = {}
+_flush_tasks: Dict[int, asyncio.Task] = {}
 
-_last_auto_start: Dict[int, float] = {}  # throttle for auto-starts
+_last_auto_start: Dict[int, float] = {}  # throttle for auto-starts (time.monotonic(); pruned each health tick)
+_AUTO_START_COOLDOWN = 90
 
 # ------------------- Image Generation -------------------
-def load_font(size: int) -> ImageFont.FreeTypeFont:
-    ttf_candidates = [
+# Font files are checked once at import; fonts and the decoded background are reused across renders.
+_TTF_CANDIDATES = [
+    path for path in (
         os.path.join(ASSETS_DIR, "Montserrat-Bold.ttf"),
         os.path.join(ASSETS_DIR, "Inter-Bold.ttf"),
         os.path.join(ASSETS_DIR, "Arial.ttf"),
-    ]
-    for path in ttf_candidates:
-        if os.path.exists(path):
-            try:
-                return ImageFont.truetype(path, size=size)
-            except Exception:
-                pass
+    )
+    if os.path.exists(path)
+]
+_BG_CACHE: Optional[Image.Image] = None
+
+@functools.lru_cache(maxsize=64)
+def load_font(size: int) -> ImageFont.FreeTypeFont:
+    for path in _TTF_CANDIDATES:
+        try:
+            return ImageFont.truetype(path, size=size)
+        except Exception:
+            pass
     return ImageFont.load_default()
 
-def _fit_font(draw: ImageDraw.ImageDraw, text: str, max_width: int, font_fn, min_size=20, max_size=64):
-    lo, hi = min_size, max_size
-    best = font_fn(min_size)
-    while lo <= hi:
-        mid = (lo + hi) // 2
-        f = font_fn(mid)
-        l, t, r, b = draw.textbbox((0, 0), text, font=f)
-        if (r - l) <= max_width:
-            best = f
-            lo = mid + 1
-        else:
-            hi = mid - 1
-    return best
+def _get_bg() -> Image.Image:
+    global _BG_CACHE
+    if _BG_CACHE is None:
+        if not os.path.exists(BACKGROUND_IMAGE):
+            raise FileNotFoundError(f"BACKGROUND_IMAGE not found: {BACKGROUND_IMAGE}")
+        _BG_CACHE = Image.open(BACKGROUND_IMAGE).convert("RGB")
+    return _BG_CACHE
+
+def warm_render_cache():
+    """Decode the background and open every name font size up front so renders never touch the TTF files."""
+    try:
+        _get_bg()
+    except FileNotFoundError as e:
+        print(f"⚠️ {e}")
+    for size in range(20, 65):  # _fit_font's min_size..max_size
+        load_font(size)
+
+# Scratch surface for measuring text outside a render; widths repeat across boards, so memoize them.
+_MEASURE_DRAW = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+@functools.lru_cache(maxsize=4096)
+def _text_width(text: str, size: int) -> int:
+    l, t, r, b = _MEASURE_DRAW.textbbox((0, 0), text, font=load_font(size))
+    return r - l
+
+def _fit_font(text: str, max_width: int, min_size=20, max_size=64):
+    # Glyph advances scale linearly with the font size, so one measurement at max_size is enough.
+    width = _text_width(text, max_size)
+    if width <= max_width:
+        return load_font(max_size)
+    size = max(min_size, min(max_size - 1, int(max_size * max_width / width)))
+    # hinting can round the scaled width up a pixel or two; step down until it really fits
+    while size > min_size and _text_width(text, size) > max_width:
+        size -= 1
+    return load_font(size)
 
 def _ellipsis_to_fit(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_width: int) -> str:
     l, t, r, b = draw.textbbox((0, 0), text, font=font)
@@ -251,21 +388,26 @@ def _ellipsis_to_fit(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeT
     return (prefix + core + "…") if core else "…"
 
 def draw_creators_connections_template(
-    left_rows: List[Tuple[str, int]],
-    right_rows: List[Tuple[str, int]]
+    left_rows: Sequence[Tuple[str, int]],
+    right_rows: Sequence[Tuple[str, int]]
 ) -> bytes:
-    if not os.path.exists(BACKGROUND_IMAGE):
-        raise FileNotFoundError(f"BACKGROUND_IMAGE not found: {BACKGROUND_IMAGE}")
+    # Only the names are drawn, so identical boards (retries, repeat weeks, test image) hit the cache
+    return _render_leaderboard(
+        tuple(str(row[0]) for row in left_rows[:LEADERBOARD_ROWS]),
+        tuple(str(row[0]) for row in right_rows[:LEADERBOARD_ROWS]),
+    )
 
-    bg = Image.open(BACKGROUND_IMAGE).convert("RGBA")
-    W, H = bg.size
+# One render at a time: Pillow work is CPU-bound, and a queued duplicate then hits _render_leaderboard's cache.
+_RENDER_SEM = asyncio.Semaphore(1)
 
-    canvas = Image.new("RGBA", (W, H))
-    canvas.alpha_composite(bg)
-    d = ImageDraw.Draw(canvas)
-    WHITE = (255, 255, 255, 255)
+async def render_leaderboard(left_rows: Sequence[Tuple[str, int]], right_rows: Sequence[Tuple[str, int]]) -> bytes:
+    async with _RENDER_SEM:
+        return await asyncio.to_thread(draw_creators_connections_template, left_rows, right_rows)
 
-    ROWS = 10
+@functools.lru_cache(maxsize=4)
+def _board_layout(W: int, H: int) -> Tuple[int, Tuple[int, ...], int, int]:
+    """Cell width, row centre y's and column centre x's for a background of this size."""
+    ROWS = LEADERBOARD_ROWS
     TABLE_TOP    = int(0.355 * H)
     TABLE_BOTTOM = int(0.905 * H)
     row_height = (TABLE_BOTTOM - TABLE_TOP) // ROWS
@@ -274,25 +416,37 @@ def draw_creators_connections_template(
     RIGHT_X  = int(0.585 * W)
     CELL_W   = int(0.315 * W)
 
-    def centered_draw(name: str, row_index: int, col_x: int):
-        font = _fit_font(d, name, CELL_W, load_font, min_size=20, max_size=64)
+    row_centers = tuple(TABLE_TOP + i * row_height + row_height // 2 for i in range(ROWS))
+    return CELL_W, row_centers, LEFT_X + CELL_W // 2, RIGHT_X + CELL_W // 2
+
+@functools.lru_cache(maxsize=32)
+def _render_leaderboard(left_names: Tuple[str, ...], right_names: Tuple[str, ...]) -> bytes:
+    canvas = _get_bg().copy()
+    d = ImageDraw.Draw(canvas)
+    WHITE = (255, 255, 255)
+    CELL_W, row_centers, x_center_left, x_center_right = _board_layout(*canvas.size)
+
+    def centered_draw(name: str, row_center_y: int, x_center: int):
+        font = _fit_font(name, CELL_W, min_size=20, max_size=64)
         txt = _ellipsis_to_fit(d, name, font, CELL_W)
         l, t, r, b = d.textbbox((0, 0), txt, font=font)
         text_w, text_h = (r - l), (b - t)
-        row_top = TABLE_TOP + row_index * row_height
-        row_center_y = row_top + row_height // 2
-        x = col_x + (CELL_W - text_w) // 2
+        x = x_center - text_w // 2
         y = row_center_y - text_h // 2
         d.text((x, y), txt, font=font, fill=WHITE)
 
-    for i in range(ROWS):
-        if i < len(left_rows):
-            centered_draw(str(left_rows[i][0]), i, LEFT_X)
-        if i < len(right_rows):
-            centered_draw(str(right_rows[i][0]), i, RIGHT_X)
+    for i, name in enumerate(left_names):
+        centered_draw(name, row_centers[i], x_center_left)
+    for i, name in enumerate(right_names):
+        centered_draw(name, row_centers[i], x_center_right)
 
     out = io.BytesIO()
-    canvas.convert("RGB").save(out, format="PNG")
+    if LEADERBOARD_FORMAT == "png":
+        canvas.save(out, format="PNG", compress_level=1)
+    elif LEADERBOARD_FORMAT == "jpeg":
+        canvas.save(out, format="JPEG", quality=88)
+    else:
+        canvas.save(out, format="WEBP", quality=85, method=4)
     return out.getvalue()
 
 # ------------------- Role Helpers -------------------
@@ -306,12 +460,12 @@ async def ensure_named_role(guild: discord.Guild, name: str) -> Optional[discord
         return None
 
 async def rotate_single_holder_role(guild: discord.Guild, role: discord.Role, winner: discord.Member, reason: str):
-    for m in guild.members:
-        if role in m.roles and m.id != winner.id:
-            try:
-                await m.remove_roles(role, reason=reason)
-            except Exception:
-                pass
+    # role.members is discord.py's reverse index, so only current holders are visited;
+    # removals are independent REST calls and run concurrently (failures ignored as before).
+    await asyncio.gather(
+        *(m.remove_roles(role, reason=reason) for m in list(role.members) if m.id != winner.id),
+        return_exceptions=True,
+    )
     if role not in winner.roles:
         try:
             await winner.add_roles(role, reason=reason)
@@ -328,53 +482,127 @@ def _rank_for_xp(xp: int) -> Tuple[str, int]:
             break
     return current_name, current_idx
 
-async def _award_xp_for_tiktok_user(guild: discord.Guild, tiktok_user: str, xp_gain: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username=?",
-            (guild.id, tiktok_user)
-        ) as cur:
-            row = await cur.fetchone()
-
-    if not row:
+async def flush_pending_xp(guild: discord.Guild):
+    """
+    Apply gift XP accumulated since the last flush in one transaction, then announce rank-ups.
+    XP from TikTok users without a /tokconnect link is dropped, as before.
+    """
+    pending = pending_xp.get(guild.id)
+    if not pending:
         return
-
-    discord_user_id = row[0]
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT xp FROM user_xp WHERE guild_id=? AND discord_user_id=?",
-            (guild.id, discord_user_id)
+    batch = Counter(pending)
+    pending.clear()
+    try:
+        users = list(batch)
+        async with DB.execute(
+            f"SELECT tiktok_username, discord_user_id FROM link_map "
+            f"WHERE guild_id=? AND tiktok_username IN ({','.join('?' * len(users))})",
+            (guild.id, *users)
         ) as cur:
-            row2 = await cur.fetchone()
-        if not row2:
-            await db.execute(
-                "INSERT INTO user_xp (guild_id, discord_user_id, xp) VALUES (?, ?, ?)",
-                (guild.id, discord_user_id, 0)
-            )
-            await db.commit()
-            old_xp = 0
-        else:
-            old_xp = int(row2[0])
-
-    new_xp = old_xp + xp_gain
-    old_rank, old_idx = _rank_for_xp(old_xp)
-    new_rank, new_idx = _rank_for_xp(new_xp)
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE user_xp SET xp=? WHERE guild_id=? AND discord_user_id=?",
-            (new_xp, guild.id, discord_user_id)
-        )
-        await db.commit()
-
-    if new_idx > old_idx:
-        member = guild.get_member(discord_user_id) or await guild.fetch_member(discord_user_id)
-        if member:
+            links = await cur.fetchall()
+        gains: Counter[int] = Counter()
+        for tiktok_user, discord_user_id in links:
+            gains[int(discord_user_id)] += batch[tiktok_user]
+        if not gains:
+            return
+
+        uids = list(gains)
+        async with DB_LOCK:
+            db = DB
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                async with db.execute(
+                    f"SELECT discord_user_id, xp FROM user_xp "
+                    f"WHERE guild_id=? AND discord_user_id IN ({','.join('?' * len(uids))})",
+                    (guild.id, *uids)
+                ) as cur:
+                    old_xp = {int(uid): int(xp or 0) for uid, xp in await cur.fetchall()}
+                await db.executemany(
+                    "INSERT INTO user_xp (guild_id, discord_user_id, xp) VALUES (?, ?, ?) "
+                    "ON CONFLICT(guild_id, discord_user_id) DO UPDATE SET xp=user_xp.xp + excluded.xp",
+                    [(guild.id, uid, gain) for uid, gain in gains.items()]
+                )
+                await db.commit()
+            except BaseException:
+                # drop the partial UPSERT so the re-queued batch is only ever applied once
+                await db.rollback()
+                raise
+    except BaseException:
+        pending.update(batch)  # keep it for the next flush
+        raise
+
+    ch = None
+    for uid, gain in gains.items():
+        old = old_xp.get(uid, 0)
+        new = old + gain
+        old_rank, old_idx = _rank_for_xp(old)
+        new_rank, new_idx = _rank_for_xp(new)
+        if new_idx <= old_idx:
+            continue
+        member = await get_or_fetch_member(guild, uid)
+        if not member:
+            continue
+        if ch is None:
             cfg = await get_guild_cfg(guild.id)
             ch = guild.get_channel(cfg.get("channel_id")) or guild.system_channel
-            if ch:
-                await ch.send(f"🏅 {member.mention} ranked up! **{old_rank} → {new_rank}** (XP: {new_xp:,})")
+            if ch is None:
+                return
+        await ch.send(f"🏅 {member.mention} ranked up! **{old_rank} → {new_rank}** (XP: {new:,})")
+
+# ------------------- Name Resolution -------------------
+async def get_or_fetch_member(guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+    """Cached member, else one REST fetch; None if they've left the guild."""
+    member = guild.get_member(user_id)
+    if member:
+        return member
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.HTTPException:
+        return None
+
+async def fetch_members(guild: discord.Guild, user_ids) -> Dict[int, discord.Member]:
+    """Members by id: cache hits first, then one gateway query per 100 misses (no per-member REST calls)."""
+    members: Dict[int, discord.Member] = {}
+    missing: List[int] = []
+    for uid in set(user_ids):
+        member = guild.get_member(uid)
+        if member:
+            members[uid] = member
+        else:
+            missing.append(uid)
+    for i in range(0, len(missing), 100):
+        batch = missing[i:i + 100]
+        try:
+            for member in await guild.query_members(user_ids=batch, limit=len(batch)):
+                members[member.id] = member
+        except Exception:
+            pass
+    return members
+
+async def resolve_names(
+    guild: discord.Guild, pairs: List[Tuple[str, int]]
+) -> List[Tuple[str, int, Optional[int]]]:
+    """Map (tiktok_user, score) pairs to (display name, score, linked discord id or None) with one link_map query."""
+    if not pairs:
+        return []
+    db = DB
+    qmarks = ",".join(["?"] * len(pairs))
+    async with db.execute(
+        f"SELECT tiktok_username, discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username IN ({qmarks})",
+        (guild.id, *[user for user, _ in pairs])
+    ) as cur:
+        uid_map = dict(await cur.fetchall())
+    members = await fetch_members(guild, uid_map.values())
+
+    out = []
+    for user, score in pairs:
+        display = f"@{user}"
+        uid = uid_map.get(user)
+        member = members.get(uid)
+        if member:
+            display = member.display_name
+        out.append((display, score, uid))
+    return out
 
 # ------------------- TikTok Handling -------------------
 def _user_id_from_event_user(u) -> str:
@@ -389,6 +617,75 @@ def _user_id_from_event_user(u) -> str:
         return str(getattr(u, "id"))
     return "unknown_user"
 
+def unflushed(live: Dict[int, Counter[str]], flushed: Dict[int, Counter[str]], guild_id: int) -> Counter[str]:
+    return (live.get(guild_id) or Counter()) - (flushed.get(guild_id) or Counter())
+
+async def flush_live_tallies(guild_id: int, ended_at: Optional[str] = None):
+    """
+    Persist tally growth since the last flush as extra rows for the current session (readers SUM per user).
+    With ended_at, the session is closed in the same transaction.
+    """
+    sid = current_session_id.get(guild_id)
+    if sid is None:
+        return
+    async with DB_LOCK:
+        deltas = [
+            (table, flushed.setdefault(guild_id, Counter()), unflushed(live, flushed, guild_id))
+            for table, live, flushed in _TALLY_TABLES
+        ]
+        if ended_at is None and not any(delta for _, _, delta in deltas):
+            return
+        db = DB
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if ended_at is not None:
+                await db.execute("UPDATE live_session SET ended_at=? WHERE id=?", (ended_at, sid))
+            for table, _, delta in deltas:
+                await db.executemany(
+                    f"INSERT INTO {table} (session_id, guild_id, tiktok_user, count) VALUES (?, ?, ?, ?)",
+                    [(sid, guild_id, user, cnt) for user, cnt in delta.items()]
+                )
+            await db.commit()
+        except BaseException:
+            # never leave a half-written batch open on the shared connection for the next commit() to pick up
+            await db.rollback()
+            raise
+        for _, done, delta in deltas:
+            done.update(delta)
+
+async def _tally_flusher(guild: discord.Guild):
+    while True:
+        await asyncio.sleep(TALLY_FLUSH_SECONDS)
+        # shielded so stop_tiktok cancelling us can't abandon a half-written transaction
+        try:
+            await asyncio.shield(flush_live_tallies(guild.id))
+        except Exception as e:
+            print(f"Tally flush failed for guild {guild.id}: {e}")
+        try:
+            await asyncio.shield(flush_pending_xp(guild))
+        except Exception as e:
+            print(f"XP flush failed for guild {guild.id}: {e}")
+
+_TIKTOK_COOKIE = f"sessionid={TIKTOK_SESSIONID}" if TIKTOK_SESSIONID else ""
+
+def _inject_tiktok_session(client: TikTokLiveClient):
+    """Best-effort: attach TIKTOK_SESSIONID to whichever cookie store / header dict this TikTokLive version exposes."""
+    if not _TIKTOK_COOKIE:
+        return
+    http = getattr(client, "http", None) or getattr(client, "_client", None)
+    try:
+        if hasattr(http, "cookies"):
+            http.cookies.set("sessionid", TIKTOK_SESSIONID, domain=".tiktok.com")
+        elif hasattr(http, "cookie_jar"):
+            http.cookie_jar.update_cookies({"sessionid": TIKTOK_SESSIONID}, response_url="https://www.tiktok.com/")
+    except Exception:
+        pass
+    headers = getattr(client, "headers", None)
+    if isinstance(headers, dict):
+        base = headers.get("cookie", "").strip()
+        if "sessionid=" not in base:
+            headers["cookie"] = f"{base}; {_TIKTOK_COOKIE}" if base else _TIKTOK_COOKIE
+
 async def start_tiktok(guild: discord.Guild):
     cfg = await get_guild_cfg(guild.id)
 
@@ -405,41 +702,21 @@ async def start_tiktok(guild: discord.Guild):
 
     try:
         client = TikTokLiveClient(unique_id=username)
-        sess = TIKTOK_SESSIONID
-        if sess:
-            try:
-                http = getattr(client, "http", None) or getattr(client, "_client", None)
-                if http and hasattr(http, "cookies"):
-                    try:
-                        http.cookies.set("sessionid", sess, domain=".tiktok.com")
-                    except Exception:
-                        http.cookies.set("sessionid", sess)
-                elif http and hasattr(http, "cookie_jar"):
-                    try:
-                        http.cookie_jar.update_cookies({"sessionid": sess}, response_url="https://www.tiktok.com/")
-                    except Exception:
-                        http.cookie_jar.update_cookies({"sessionid": sess})
-                if hasattr(client, "headers") and isinstance(client.headers, dict):
-                    base = client.headers.get("cookie", "").strip()
-                    add = f"sessionid={sess}"
-                    if base:
-                        if "sessionid=" not in base:
-                            client.headers["cookie"] = base + "; " + add
-                    else:
-                        client.headers["cookie"] = add
-            except Exception:
-                if hasattr(client, "headers") and isinstance(client.headers, dict):
-                    client.headers["cookie"] = f"sessionid={sess}"
+        _inject_tiktok_session(client)
     except Exception as e:
         raise RuntimeError(f"Failed to create TikTok client for @{username}: {e}")
 
     running_clients[guild.id] = client
-    live_gifters[guild.id] = {}
-    live_commenters[guild.id] = {}
-    live_likers[guild.id] = {}
+    for _, live, flushed in _TALLY_TABLES:
+        live[guild.id] = Counter()
+        flushed[guild.id] = Counter()
+    # handlers close over this client's buckets; they're cleared in place, never replaced, until the next start
+    gifts, comments, likes = live_gifters[guild.id], live_commenters[guild.id], live_likers[guild.id]
+    xp_owed = pending_xp.setdefault(guild.id, Counter())
 
     async def open_session():
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with DB_LOCK:
+            db = DB
             cur = await db.execute(
                 "INSERT INTO live_session (guild_id, tiktok_username, started_at) VALUES (?, ?, ?)",
                 (guild.id, username, now_tz(cfg.get("timezone", DEFAULT_TZ)).isoformat())
@@ -449,6 +726,9 @@ async def start_tiktok(guild: discord.Guild):
 
     @client.on(ConnectEvent)
     async def on_connect(_: ConnectEvent):
+        if current_session_id.get(guild.id) is not None:
+            # reconnect: close the old session (with anything unflushed) before tallies move to the new one
+            await flush_live_tallies(guild.id, ended_at=now_tz(cfg.get("timezone", DEFAULT_TZ)).isoformat())
         sid = await open_session()
         current_session_id[guild.id] = sid
         ch = guild.get_channel(channel_id)
@@ -462,10 +742,10 @@ async def start_tiktok(guild: discord.Guild):
             repeat = int(getattr(event.gift, "repeatCount", 1) or 1)
             diamonds = getattr(event.gift, "diamond_count", None) or getattr(event.gift, "diamondCount", None)
             amount = repeat
-            live_gifters[guild.id][user] = live_gifters[guild.id].get(user, 0) + amount
+            gifts[user] += amount
 
             xp_gain = (diamonds if (isinstance(diamonds, int) and diamonds > 0) else DEFAULT_XP_PER_GIFT) * repeat
-            asyncio.create_task(_award_xp_for_tiktok_user(guild, user, xp_gain))
+            xp_owed[user] += xp_gain
 
             if DEBUG_TIKTOK:
                 ch = guild.get_channel(channel_id)
@@ -480,7 +760,7 @@ async def start_tiktok(guild: discord.Guild):
     async def on_comment(event: CommentEvent):
         try:
             user = _user_id_from_event_user(event.user)
-            live_commenters[guild.id][user] = live_commenters[guild.id].get(user, 0) + 1
+            comments[user] += 1
             if DEBUG_TIKTOK:
                 ch = guild.get_channel(channel_id)
                 if ch:
@@ -495,7 +775,7 @@ async def start_tiktok(guild: discord.Guild):
         try:
             user = _user_id_from_event_user(event.user)
             cnt = int(getattr(event, "likeCount", 1) or 1)
-            live_likers[guild.id][user] = live_likers[guild.id].get(user, 0) + cnt
+            likes[user] += cnt
             if DEBUG_TIKTOK:
                 ch = guild.get_channel(channel_id)
                 if ch:
@@ -510,70 +790,59 @@ async def start_tiktok(guild: discord.Guild):
         cfg_local = await get_guild_cfg(guild.id)
         tz = cfg_local.get("timezone", DEFAULT_TZ)
         channel = guild.get_channel(cfg_local.get("channel_id"))
-        sid = current_session_id.get(guild.id)
-
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("UPDATE live_session SET ended_at=? WHERE id=?", (now_tz(tz).isoformat(), sid))
-            for user, cnt in live_gifters[guild.id].items():
-                await db.execute("INSERT INTO live_gift VALUES (?, ?, ?, ?)", (sid, guild.id, user, cnt))
-            for user, cnt in live_commenters[guild.id].items():
-                await db.execute("INSERT INTO live_comment VALUES (?, ?, ?, ?)", (sid, guild.id, user, cnt))
-            for user, cnt in live_likers[guild.id].items():
-                await db.execute("INSERT INTO live_like VALUES (?, ?, ?, ?)", (sid, guild.id, user, cnt))
-            await db.commit()
 
-        gifts_sorted = sorted(live_gifters[guild.id].items(), key=lambda x: x[1], reverse=True)
-        tappers_sorted = sorted(live_likers[guild.id].items(), key=lambda x: x[1], reverse=True)
-
-        async def resolve_names(pairs):
-            out = []
-            async with aiosqlite.connect(DB_PATH) as db:
-                for user, score in pairs:
-                    async with db.execute(
-                        "SELECT discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username=?",
-                        (guild.id, user)
-                    ) as cur:
-                        row = await cur.fetchone()
-                    display = f"@{user}"
-                    if row:
-                        member = guild.get_member(row[0]) or await guild.fetch_member(row[0])
-                        if member:
-                            display = member.display_name
-                    out.append((display, score))
-            return out
-
-        gifts_display = await resolve_names(gifts_sorted)
-        taps_display = await resolve_names(tappers_sorted)
+        await flush_live_tallies(guild.id, ended_at=now_tz(tz).isoformat())
+        current_session_id.pop(guild.id, None)
+        try:
+            await flush_pending_xp(guild)
+        except Exception as e:
+            print(f"XP flush failed for guild {guild.id}: {e}")
+
+        gifts_sorted = gifts.most_common(LEADERBOARD_ROWS)
+        tappers_sorted = likes.most_common(LEADERBOARD_ROWS)
+
+        gifts_display, taps_display = await asyncio.gather(
+            resolve_names(guild, gifts_sorted), resolve_names(guild, tappers_sorted)
+        )
 
         if channel:
-            cc_img = draw_creators_connections_template(gifts_display, taps_display)
+            cc_img = await render_leaderboard(gifts_display, taps_display)
             await channel.send(
                 POST_LIVE_MESSAGE,
-                file=discord.File(io.BytesIO(cc_img), filename="creators_connections.png")
+                file=discord.File(io.BytesIO(cc_img), filename=f"creators_connections.{LEADERBOARD_FORMAT}")
             )
 
-        if gifts_sorted:
-            top_tiktok = gifts_sorted[0][0]
-            async with aiosqlite.connect(DB_PATH) as db:
-                async with db.execute(
-                    "SELECT discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username=?",
-                    (guild.id, top_tiktok)
-                ) as cur:
-                    row = await cur.fetchone()
-            if row:
-                member = guild.get_member(row[0]) or await guild.fetch_member(row[0])
-                if member:
-                    top_role = await ensure_named_role(guild, "Top Gifter")
-                    if top_role:
-                        await rotate_single_holder_role(guild, top_role, member, "Top gifter of last live")
+        if gifts_display:
+            top_uid = gifts_display[0][2]
+            member = guild.get_member(top_uid) if top_uid else None
+            if member:
+                top_role = await ensure_named_role(guild, "Top Gifter")
+                if top_role:
+                    await rotate_single_holder_role(guild, top_role, member, "Top gifter of last live")
 
-        live_gifters[guild.id].clear()
-        live_commenters[guild.id].clear()
-        live_likers[guild.id].clear()
+        for _, live, flushed in _TALLY_TABLES:
+            live[guild.id].clear()
+            flushed[guild.id].clear()
 
+    _flush_tasks[guild.id] = asyncio.create_task(_tally_flusher(guild))
     asyncio.create_task(client.start())
 
 async def stop_tiktok(guild: discord.Guild):
+    task = _flush_tasks.pop(guild.id, None)
+    if task:
+        task.cancel()
+    # close the open session so its rows don't match every later weekly window (ended_at IS NULL)
+    if current_session_id.get(guild.id) is not None:
+        cfg = await get_guild_cfg(guild.id)
+        try:
+            await flush_live_tallies(guild.id, ended_at=now_tz(cfg.get("timezone", DEFAULT_TZ)).isoformat())
+        except Exception:
+            pass
+        current_session_id.pop(guild.id, None)
+    try:
+        await flush_pending_xp(guild)
+    except Exception:
+        pass
     client = running_clients.get(guild.id)
     if client:
         try:
@@ -585,50 +854,43 @@ async def stop_tiktok(guild: discord.Guild):
 # ------------------- Weekly Summary (fixed) + Sore Finger -------------------
 async def compute_weekly_lists(guild_id: int, start: datetime, end: datetime):
     """
-    Returns (gifts_sorted, likes_sorted) for sessions that OVERLAP [start, end].
+    Returns top-LEADERBOARD_ROWS (gifts_sorted, likes_sorted) for sessions that OVERLAP [start, end].
     Also merges in-memory tallies for any currently running session so we never post blank.
     """
-    gifts: Dict[str, int] = {}
-    likes: Dict[str, int] = {}
-
-    # DB totals for overlapping sessions
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            """
-            SELECT id FROM live_session
-            WHERE guild_id=?
-              AND started_at <= ?
-              AND (ended_at IS NULL OR ended_at >= ?)
-            """,
-            (guild_id, end.isoformat(), start.isoformat())
-        ) as cur:
-            sids = [row[0] for row in await cur.fetchall()]
-
-        if sids:
-            qmarks = ",".join(["?"] * len(sids))
-            async with db.execute(
-                f"SELECT tiktok_user, SUM(count) FROM live_gift WHERE session_id IN ({qmarks}) GROUP BY tiktok_user",
-                sids
-            ) as cur:
-                for u, total in await cur.fetchall():
-                    gifts[u] = gifts.get(u, 0) + int(total or 0)
-            async with db.execute(
-                f"SELECT tiktok_user, SUM(count) FROM live_like WHERE session_id IN ({qmarks}) GROUP BY tiktok_user",
-                sids
-            ) as cur:
-                for u, total in await cur.fetchall():
-                    likes[u] = likes.get(u, 0) + int(total or 0)
-
-    # Merge current in-memory tallies (covers ongoing live or missed flush)
-    gifts_live = live_gifters.get(guild_id, {})
-    likes_live = live_likers.get(guild_id, {})
-    for u, c in gifts_live.items():
-        gifts[u] = gifts.get(u, 0) + int(c)
-    for u, c in likes_live.items():
-        likes[u] = likes.get(u, 0) + int(c)
-
-    gifts_sorted = sorted(gifts.items(), key=lambda x: x[1], reverse=True)
-    likes_sorted = sorted(likes.items(), key=lambda x: x[1], reverse=True)
+    db = DB
+
+    async def top(table: str, live: Counter[str]) -> List[Tuple[str, int]]:
+        # Aggregate inside SQLite; only let it apply the LIMIT when there is nothing to merge in
+        sql = f"""
+            SELECT t.tiktok_user, SUM(t.count) AS total
+            FROM {table} t JOIN live_session s ON s.id = t.session_id
+            WHERE s.guild_id=?
+              AND s.started_at <= ?
+              AND (s.ended_at IS NULL OR s.ended_at >= ?)
+            GROUP BY t.tiktok_user
+        """
+        params: tuple = (guild_id, end.isoformat(), start.isoformat())
+        if not live:
+            sql += " ORDER BY total DESC LIMIT ?"
+            params += (LEADERBOARD_ROWS,)
+        async with db.execute(sql, params) as cur:
+            rows = [(u, int(total or 0)) for u, total in await cur.fetchall()]
+        if not live:
+            return rows
+        # Merge the not-yet-flushed part of the live tallies (flushed rows are already in the JOIN)
+        totals = Counter(live)
+        for u, total in rows:
+            totals[u] += total
+        return totals.most_common(LEADERBOARD_ROWS)
+
+    # Under DB_LOCK so a concurrent flush can't insert these same deltas between the unflushed()
+    # snapshot and the SELECT (its uncommitted rows are visible on this connection and would count twice).
+    # Both queries still go onto the connection's queue together instead of waiting for each other.
+    async with DB_LOCK:
+        gifts_sorted, likes_sorted = await asyncio.gather(
+            top("live_gift", unflushed(live_gifters, flushed_gifters, guild_id)),
+            top("live_like", unflushed(live_likers, flushed_likers, guild_id)),
+        )
     return gifts_sorted, likes_sorted
 
 async def post_weekly_summary(guild_id: int):
@@ -639,56 +901,30 @@ async def post_weekly_summary(guild_id: int):
     ch = guild.get_channel(cfg.get("channel_id"))
     if ch is None:
         return
-    tz = pytz.timezone(cfg.get("timezone", DEFAULT_TZ))
+    tz = _tz(cfg.get("timezone", DEFAULT_TZ))
     end = datetime.now(tz)
     start = end - timedelta(days=7)
 
     gifts, likes = await compute_weekly_lists(guild_id, start, end)
 
-    # name resolution
-    async def resolve_names(pairs):
-        out = []
-        async with aiosqlite.connect(DB_PATH) as db:
-            for user, score in pairs:
-                async with db.execute(
-                    "SELECT discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username=?",
-                    (guild.id, user)
-                ) as cur:
-                    row = await cur.fetchone()
-                display = f"@{user}"
-                if row:
-                    member = guild.get_member(row[0]) or await guild.fetch_member(row[0])
-                    if member:
-                        display = member.display_name
-                out.append((display, score))
-        return out
-
-    gifts_display = await resolve_names(gifts)
-    taps_display = await resolve_names(likes)
-
-    img = draw_creators_connections_template(gifts_display, taps_display)
+    gifts_display, taps_display = await asyncio.gather(resolve_names(guild, gifts), resolve_names(guild, likes))
+
+    img = await render_leaderboard(gifts_display, taps_display)
     await ch.send(
         "📅 **Creators Connections — Weekly Summary**\nLeft: Top Gifters • Right: Top Tappers",
-        file=discord.File(io.BytesIO(img), filename="creators_connections_weekly.png")
+        file=discord.File(io.BytesIO(img), filename=f"creators_connections_weekly.{LEADERBOARD_FORMAT}")
     )
     await ch.send("🔗 Link your TikTok with `/tokconnect your_tiktok_name` (without @) to get ranked!")
 
-    if likes:
-        top_tiktok = likes[0][0]
+    if taps_display:
+        top_uid = taps_display[0][2]
         role = await ensure_named_role(guild, "Sore Finger")
-        if role:
-            async with aiosqlite.connect(DB_PATH) as db:
-                async with db.execute(
-                    "SELECT discord_user_id FROM link_map WHERE guild_id=? AND tiktok_username=?",
-                    (guild.id, top_tiktok)
-                ) as cur:
-                    row = await cur.fetchone()
-            if row:
-                winner = guild.get_member(row[0]) or await guild.fetch_member(row[0])
-                if winner:
-                    await rotate_single_holder_role(guild, role, winner, "Weekly top tapper")
-                    sysch = guild.system_channel or ch
-                    await sysch.send(f"🖐️ {winner.mention} now has sore fingers!")
+        if role and top_uid:
+            winner = guild.get_member(top_uid)
+            if winner:
+                await rotate_single_holder_role(guild, role, winner, "Weekly top tapper")
+                sysch = guild.system_channel or ch
+                await sysch.send(f"🖐️ {winner.mention} now has sore fingers!")
 
 # ------------------- Monthly XP Tally -------------------
 async def post_monthly_xp_tally(guild_id: int):
@@ -701,9 +937,10 @@ async def post_monthly_xp_tally(guild_id: int):
         return
 
     # dedupe check
-    tz = pytz.timezone(cfg.get("timezone", DEFAULT_TZ))
+    tz = _tz(cfg.get("timezone", DEFAULT_TZ))
     stamp = yyyymm(datetime.now(tz))
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB_LOCK:
+        db = DB
         async with db.execute(
             "SELECT 1 FROM monthly_posted WHERE guild_id=? AND yyyymm=?",
             (guild_id, stamp)
@@ -714,138 +951,252 @@ async def post_monthly_xp_tally(guild_id: int):
         await db.commit()
 
     # Load all XP and group by rank
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT discord_user_id, xp FROM user_xp WHERE guild_id=? ORDER BY xp DESC",
-            (guild_id,)
-        ) as cur:
-            rows = await cur.fetchall()
+    db = DB
+    async with db.execute(
+        "SELECT discord_user_id, xp FROM user_xp WHERE guild_id=? ORDER BY xp DESC",
+        (guild_id,)
+    ) as cur:
+        rows = await cur.fetchall()
 
     if not rows:
         await ch.send("📊 **Monthly XP Tally** — No data yet.")
         return
 
+    # the tally can name most of the guild: pull the member list in one gateway request, then label from memory
+    if not guild.chunked:
+        try:
+            await guild.chunk(cache=True)
+        except Exception:
+            pass
+    labels = {uid: m.display_name for uid, m in (await fetch_members(guild, [int(uid) for uid, _ in rows])).items()}
+
     groups: Dict[str, List[Tuple[int, int]]] = {}
     for uid, xp in rows:
         rank, _ = _rank_for_xp(int(xp or 0))
         groups.setdefault(rank, []).append((int(uid), int(xp)))
 
-    # order ranks by RANKS array
+    # order ranks by RANKS array; pack the tally into as few <2000-char messages as possible
     rank_order = [name for name, _ in RANKS]
-    header = "📊 **Monthly XP Tally** — Everyone by current rank"
-    await ch.send(header)
-
+    msgs = ["📊 **Monthly XP Tally** — Everyone by current rank"]
     for rank_name in rank_order:
         members = groups.get(rank_name, [])
         if not members:
             continue
-        # build chunked messages to respect 2000-char limit
-        lines = [f"**{rank_name}**"]
-        current_block = ""
+        current = f"**{rank_name}**\n"
         for uid, xp in members:
-            member = guild.get_member(uid) or (await guild.fetch_member(uid) if guild.get_member(uid) is None else None)
-            label = member.display_name if member else f"<@{uid}>"
+            label = discord.utils.escape_markdown(labels[uid]) if uid in labels else f"<@{uid}>"
             entry = f"- {label} — {xp:,} XP\n"
-            if len(current_block) + len(entry) > 1800:  # start a new message
-                await ch.send("\n".join(lines) + "\n" + f"```{current_block}```")
-                lines = [f"**{rank_name}** (cont.)"]
-                current_block = entry
+            if len(current) + len(entry) > 1900:  # start a new message
+                msgs.append(current)
+                current = f"**{rank_name}** (cont.)\n" + entry
             else:
-                current_block += entry
-        if current_block:
-            await ch.send("\n".join(lines) + "\n" + f"```{current_block}```")
+                current += entry
+        if len(msgs[-1]) + 1 + len(current) <= 1900:  # small ranks share a message
+            msgs[-1] += "\n" + current
+        else:
+            msgs.append(current)
+
+    # sent in order (the tally reads top-down); discord.py paces them against the channel rate limit.
+    # Labels are no longer inside a code block, so make sure the <@id> fallbacks don't ping anyone.
+    quiet = discord.AllowedMentions.none()
+    for msg in msgs:
+        await ch.send(msg, allowed_mentions=quiet)
 
 # ------------------- Health / Uptime auto-start -------------------
-async def _is_tiktok_live(username: str) -> bool:
-    headers = {
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124 Safari/537.36",
-        "Accept": "application/json,text/html;q=0.9,*/*;q=0.8",
-    }
-    cookies = {}
-    if TIKTOK_SESSIONID:
-        cookies["sessionid"] = TIKTOK_SESSIONID
+# One HTTP session for all live probes (keeps TLS connections to TikTok warm); closed in CreatorConnectionsBot.close.
+_HTTP_SESSION: Optional[ClientSession] = None
+
+def _http_session() -> ClientSession:
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        headers = {
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124 Safari/537.36",
+            "Accept": "application/json,text/html;q=0.9,*/*;q=0.8",
+        }
+        cookies = {}
+        if TIKTOK_SESSIONID:
+            cookies["sessionid"] = TIKTOK_SESSIONID
+        # probes only ever hit tiktok.com: keep a few sockets alive between health pings and cache its DNS
+        connector = TCPConnector(limit=16, ttl_dns_cache=300, keepalive_timeout=60)
+        _HTTP_SESSION = ClientSession(
+            headers=headers, cookies=cookies, connector=connector, timeout=ClientTimeout(total=6)
+        )
+    return _HTTP_SESSION
+
+# Markers of a live room in the API JSON / profile page, matched on raw bytes (case-insensitive, no decode or lower())
+_API_LIVE_RE = re.compile(rb'"islive":true|"status":1|"live_room_id"', re.IGNORECASE)
+_PAGE_LIVE_RE = re.compile(rb'"islive":true|"roomid":"|"live_room_id"', re.IGNORECASE)
+
+async def _body_matches(resp, pattern: "re.Pattern[bytes]") -> bool:
+    """Scan the body chunk by chunk and stop at the first hit; a short tail carries matches across chunk edges."""
+    tail = b""
+    async for chunk in resp.content.iter_chunked(8192):
+        buf = tail + chunk
+        if pattern.search(buf):
+            return True
+        tail = buf[-16:]
+    return False
 
-    timeout = ClientTimeout(total=6)
-    async with ClientSession(headers=headers, cookies=cookies, timeout=timeout) as session:
-        try:
-            url = f"https://www.tiktok.com/api/live/detail/?aid=1988&uniqueId={username}"
-            async with session.get(url) as r:
-                txt = await r.text()
-                low = txt.lower()
-                if '"islive":true' in low or '"status":1' in low or '"live_room_id"' in low:
-                    return True
-        except Exception:
-            pass
-        try:
-            url2 = f"https://www.tiktok.com/@{username}"
-            async with session.get(url2) as r2:
-                page = (await r2.text()).lower()
-                if '"islive":true' in page or '"roomid":"' in page or '"live_room_id"' in page:
-                    return True
-        except Exception:
-            pass
+# url -> (ETag, whether that version of the body showed a live marker), for conditional re-probes
+_probe_etags: Dict[str, Tuple[str, bool]] = {}
+
+async def _probe_url(session: ClientSession, url: str, pattern: "re.Pattern[bytes]") -> bool:
+    known = _probe_etags.get(url)
+    headers = {"If-None-Match": known[0]} if known else None
+    async with session.get(url, headers=headers) as r:
+        if r.status == 304 and known:
+            return known[1]
+        hit = await _body_matches(r, pattern)
+        etag = r.headers.get("ETag")
+        if etag:
+            _probe_etags[url] = (etag, hit)
+        else:
+            _probe_etags.pop(url, None)
+        return hit
+
+async def _is_tiktok_live(username: str) -> bool:
+    session = _http_session()
+    try:
+        if await _probe_url(session, f"https://www.tiktok.com/api/live/detail/?aid=1988&uniqueId={username}", _API_LIVE_RE):
+            return True
+    except Exception:
+        pass
+    try:
+        if await _probe_url(session, f"https://www.tiktok.com/@{username}", _PAGE_LIVE_RE):
+            return True
+    except Exception:
+        pass
     return False
 
 async def _health_tick():
-    for guild in list(bot.guilds):
-        try:
-            cfg = await get_guild_cfg(guild.id)
-            username = (cfg.get("tiktok_username") or "").strip().lstrip("@")
-            if not username:
-                continue
-            if running_clients.get(guild.id):
-                continue
-            prev = _last_auto_start.get(guild.id, 0.0)
-            if time.time() - prev < 90:
-                continue
-            if await _is_tiktok_live(username):
-                _last_auto_start[guild.id] = time.time()
-                await start_tiktok(guild)
-        except Exception:
-            pass
+    # expired cooldowns are dropped, so the throttle map only holds guilds started in the last 90s
+    cutoff = time.monotonic() - _AUTO_START_COOLDOWN
+    for gid in [gid for gid, ts in _last_auto_start.items() if ts < cutoff]:
+        del _last_auto_start[gid]
+
+    # probe guilds concurrently; the semaphore caps simultaneous requests to TikTok
+    sem = asyncio.Semaphore(16)
+
+    async def probe(guild: discord.Guild):
+        cfg = await get_guild_cfg(guild.id)
+        username = (cfg.get("tiktok_username") or "").strip().lstrip("@")
+        if not username:
+            return
+        if running_clients.get(guild.id):
+            return
+        if guild.id in _last_auto_start:
+            return
+        async with sem:
+            live = await _is_tiktok_live(username)
+        if live:
+            _last_auto_start[guild.id] = time.monotonic()
+            await start_tiktok(guild)
+
+    await asyncio.gather(*(probe(g) for g in bot.guilds), return_exceptions=True)
+
+_OK_BODY = b"ok"
+# Pingers can hit /health every few seconds; run at most one tick per minute and never two at once.
+_TICK_INTERVAL = 60
+_tick_task: Optional[asyncio.Task] = None
+_tick_last = float("-inf")
 
 async def _ok(_: web.Request) -> web.Response:
-    asyncio.create_task(_health_tick())
-    return web.Response(text="ok")
+    global _tick_task, _tick_last
+    now = time.monotonic()
+    if (_tick_task is None or _tick_task.done()) and now - _tick_last >= _TICK_INTERVAL:
+        _tick_last = now
+        _tick_task = asyncio.create_task(_health_tick())
+    return web.Response(body=_OK_BODY, content_type="text/plain")
 
 async def start_keepalive():
     app = web.Application()
     app.add_routes([web.get("/", _ok), web.get("/health", _ok)])
-    runner = web.AppRunner(app)
+    # uptime pings carry no useful information, so skip per-request access logging
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
-    site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
+    site = web.TCPSite(runner, host="0.0.0.0", port=PORT, backlog=16)
     await site.start()
     print(f"Keep-alive server running on 0.0.0.0:{PORT}")
 
 # ------------------- Schedulers -------------------
+# Set whenever guild config (or the guild list) changes so the scheduler recomputes its deadlines.
+_schedule_changed = asyncio.Event()
+
+def _next_weekly_run(tz, now: datetime, day: int, hour: int, minute: int) -> datetime:
+    """Next local occurrence of isoweekday `day` at hour:minute strictly after `now`."""
+    local = now.astimezone(tz).replace(tzinfo=None)
+    target = (local + timedelta(days=(day - local.isoweekday()) % 7)).replace(
+        hour=hour, minute=minute, second=0, microsecond=0
+    )
+    if target <= local:
+        target += timedelta(days=7)
+    return tz.localize(target)
+
+def _next_monthly_run(tz, now: datetime) -> datetime:
+    """Next 1st of the month @ 12:00 local strictly after `now`."""
+    local = now.astimezone(tz).replace(tzinfo=None)
+    target = local.replace(day=1, hour=12, minute=0, second=0, microsecond=0)
+    if target <= local:
+        target = (target + timedelta(days=32)).replace(day=1)
+    return tz.localize(target)
+
+async def _next_run(guild_id: int, kind: str, after: datetime) -> datetime:
+    cfg = await get_guild_cfg(guild_id)
+    tz = _tz(cfg.get("timezone", DEFAULT_TZ))
+    if kind == "weekly":
+        return _next_weekly_run(
+            tz, after,
+            cfg.get("weekly_day") or 6,
+            cfg.get("weekly_hour") or 19,
+            cfg.get("weekly_minute") or 0,
+        )
+    return _next_monthly_run(tz, after)
+
 async def scheduler():
+    """Sleep until the earliest weekly/monthly deadline across guilds instead of polling every minute."""
     await bot.wait_until_ready()
     while not bot.is_closed():
+        _schedule_changed.clear()
+        now = datetime.now(pytz.utc)
+        heap: List[Tuple[datetime, int, str]] = []
         for guild in bot.guilds:
-            cfg = await get_guild_cfg(guild.id)
-            tz = pytz.timezone(cfg.get("timezone", DEFAULT_TZ))
-            now = datetime.now(tz)
-
-            # Weekly summary
-            if (now.isoweekday() == (cfg.get("weekly_day") or 6)
-                and now.hour == (cfg.get("weekly_hour") or 19)
-                and now.minute == (cfg.get("weekly_minute") or 0)):
-                await post_weekly_summary(guild.id)
-
-            # Monthly XP tally — 1st @ 12:00
-            if (now.day == 1 and now.hour == 12 and now.minute == 0):
-                await post_monthly_xp_tally(guild.id)
-
-        await asyncio.sleep(60)
+            for kind in ("weekly", "monthly"):
+                heap.append((await _next_run(guild.id, kind, now), guild.id, kind))
+        heapq.heapify(heap)
+
+        while not bot.is_closed():
+            if heap:
+                run_at, guild_id, kind = heap[0]
+                delay = (run_at - datetime.now(pytz.utc)).total_seconds()
+            else:
+                delay = None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(_schedule_changed.wait(), timeout=delay)
+                    break  # config changed -> rebuild deadlines
+                except asyncio.TimeoutError:
+                    pass
+
+            heapq.heappop(heap)
+            try:
+                if kind == "weekly":
+                    await post_weekly_summary(guild_id)
+                else:
+                    # Monthly XP tally — 1st @ 12:00
+                    await post_monthly_xp_tally(guild_id)
+            except Exception as e:
+                print(f"Scheduled {kind} post failed for guild {guild_id}: {e}")
+            heapq.heappush(heap, (await _next_run(guild_id, kind, run_at), guild_id, kind))
 
 # ------------------- Commands -------------------
 @tree.command(name="tokconnect", description="Link your TikTok username to your Discord (viewer-level)")
 async def tokconnect(interaction: discord.Interaction, username: str):
     await interaction.response.defer(ephemeral=True, thinking=True)
     handle = username.strip().lstrip("@")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB_LOCK:
+        db = DB
         await db.execute(
-            "INSERT INTO link_map VALUES (?, ?, ?) "
+            "INSERT INTO link_map (guild_id, tiktok_username, discord_user_id) VALUES (?, ?, ?) "
             "ON CONFLICT(guild_id, tiktok_username) DO UPDATE SET discord_user_id=excluded.discord_user_id",
             (interaction.guild_id, handle, interaction.user.id)
         )
@@ -855,15 +1206,15 @@ async def tokconnect(interaction: discord.Interaction, username: str):
 @tree.command(name="toktrack", description="Admin: set the TikTok host account to track")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def toktrack(interaction: discord.Interaction, username: str):
-    await interaction.response.defer(ephemeral=True, thinking=True)
-    await upsert_guild_cfg(interaction.guild_id, tiktok_username=username.strip().lstrip('@'))
-    await interaction.followup.send(f"✅ Host set to @{username.strip().lstrip('@')}", ephemeral=True)
+    handle = username.strip().lstrip('@')
+    # the reply doesn't depend on the write, so answer right away instead of defer + followup
+    run_in_background(upsert_guild_cfg(interaction.guild_id, tiktok_username=handle), f"/toktrack for guild {interaction.guild_id}")
+    await interaction.response.send_message(f"✅ Host set to @{handle}", ephemeral=True)
 
 @tree.command(name="set_target_channel", description="Set the channel for leaderboard posts")
 async def set_target_channel(interaction: discord.Interaction, channel: discord.TextChannel):
-    await interaction.response.defer(ephemeral=True, thinking=True)
-    await upsert_guild_cfg(interaction.guild_id, channel_id=channel.id)
-    await interaction.followup.send(f"Target channel set to {channel.mention}", ephemeral=True)
+    run_in_background(upsert_guild_cfg(interaction.guild_id, channel_id=channel.id), f"/set_target_channel for guild {interaction.guild_id}")
+    await interaction.response.send_message(f"Target channel set to {channel.mention}", ephemeral=True)
 
 @tree.command(name="start_tiktok", description="Start TikTok tracking for this server")
 async def start_cmd(interaction: discord.Interaction):
@@ -910,64 +1261,63 @@ async def backscan(interaction: discord.Interaction, limit: app_commands.Range[i
     if not scan_ch:
         await interaction.followup.send("❌ No channel to scan. Set one via /set_target_channel or pass a channel.", ephemeral=True)
         return
-    pattern = re.compile(r"(?:tiktok\.com/\@|\B\@)([A-Za-z0-9._-]{2,24})")
     found: Dict[int, set[str]] = {}
+    rows: List[Tuple[int, str, int]] = []
     async for msg in scan_ch.history(limit=limit):
-        for m in pattern.finditer(msg.content or ""):
-            handle = m.group(1).strip("@")
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    "INSERT INTO link_map (guild_id, tiktok_username, discord_user_id) VALUES (?, ?, ?) "
-                    "ON CONFLICT(guild_id, tiktok_username) DO UPDATE SET discord_user_id=excluded.discord_user_id",
-                    (interaction.guild_id, handle, msg.author.id)
-                )
-                await db.commit()
+        content = msg.content or ""
+        if "@" not in content:
+            continue
+        for m in HANDLE_RE.finditer(content):
+            handle = m.group(1) or m.group(2)
+            rows.append((interaction.guild_id, handle, msg.author.id))
             found.setdefault(msg.author.id, set()).add(handle)
+    if rows:
+        async with DB_LOCK:
+            db = DB
+            await db.executemany(
+                "INSERT INTO link_map (guild_id, tiktok_username, discord_user_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(guild_id, tiktok_username) DO UPDATE SET discord_user_id=excluded.discord_user_id",
+                rows
+            )
+            await db.commit()
     if not found:
         await interaction.followup.send("No TikTok handles found in recent messages.", ephemeral=True)
         return
+    members = await fetch_members(interaction.guild, found)
     lines = ["**Backscan results:**"]
     for uid, handles in found.items():
-        member = interaction.guild.get_member(uid) or await interaction.guild.fetch_member(uid)
-        lines.append(f"• {member.display_name}: " + ", ".join(f"@{h}" for h in sorted(handles)))
+        member = members.get(uid)
+        label = member.display_name if member else f"<@{uid}>"
+        lines.append(f"• {label}: " + ", ".join(f"@{h}" for h in sorted(handles)))
     await interaction.followup.send("\n".join(lines), ephemeral=True)
 
+_TEST_LEFT = tuple((f"userGifter{i}", 110 - i * 10) for i in range(1, 11))
+_TEST_RIGHT = tuple((f"userTapper{i}", 5000 - i * 250) for i in range(1, 11))
+
 @tree.command(name="cc_test_image", description="(Admin) Post a test leaderboard with dummy data")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def cc_test_image(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=False, thinking=True)
-    left = [(f"userGifter{i}", 110 - i * 10) for i in range(1, 11)]
-    right = [(f"userTapper{i}", 5000 - i * 250) for i in range(1, 11)]
-    img_bytes = draw_creators_connections_template(left, right)
+    img_bytes = await render_leaderboard(_TEST_LEFT, _TEST_RIGHT)
     await interaction.followup.send(
         "🧪 **Creators Connections — Test Image**\nLeft: Top Gifters • Right: Top Tappers",
-        file=discord.File(io.BytesIO(img_bytes), filename="creators_connections_TEST.png"),
+        file=discord.File(io.BytesIO(img_bytes), filename=f"creators_connections_TEST.{LEADERBOARD_FORMAT}"),
     )
 
 @tree.command(name="cc_status", description="Show TikTok tracking status & current tallies")
 async def cc_status(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True, thinking=True)
     client = running_clients.get(interaction.guild_id)
-    ggifters = live_gifters.get(interaction.guild_id, {})
-    glikers = live_likers.get(interaction.guild_id, {})
+    ggifters = live_gifters.get(interaction.guild_id, Counter())
+    glikers = live_likers.get(interaction.guild_id, Counter())
     state = "running" if client else "stopped"
-    top_gifters = ", ".join([f"@{u}:{c}" for u, c in sorted(ggifters.items(), key=lambda x: x[1], reverse=True)[:5]]) or "none"
-    top_likers = ", ".join([f"@{u}:{c}" for u, c in sorted(glikers.items(), key=lambda x: x[1], reverse=True)[:5]]) or "none"
+    top_gifters = ", ".join(f"@{u}:{c}" for u, c in ggifters.most_common(5)) or "none"
+    top_likers = ", ".join(f"@{u}:{c}" for u, c in glikers.most_common(5)) or "none"
     await interaction.followup.send(
         f"Status: **{state}**\nTop gifters (live): {top_gifters}\nTop likers (live): {top_likers}",
         ephemeral=True
     )
 
-# ------------------- Keep-Alive Web Server -------------------
-async def start_keepalive():
-    app = web.Application()
-    app.add_routes([web.get("/", lambda r: _ok(r)), web.get("/health", lambda r: _ok(r))])
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
-    await site.start()
-    print(f"Keep-alive server running on 0.0.0.0:{PORT}")
-
 # ------------------- Lifecycle -------------------
 @bot.event
 async def on_member_join(member: discord.Member):
@@ -983,6 +1333,7 @@ async def on_member_join(member: discord.Member):
 async def on_guild_join(guild: discord.Guild):
     await ensure_named_role(guild, "Sore Finger")
     await ensure_named_role(guild, "Top Gifter")
+    _schedule_changed.set()
 
 @bot.event
 async def on_guild_available(guild: discord.Guild):
@@ -991,7 +1342,9 @@ async def on_guild_available(guild: discord.Guild):
 
 @bot.event
 async def on_ready():
-    await ensure_db()
+    await asyncio.to_thread(warm_render_cache)
+    # fill the member cache up front so name resolution and role rotation are cache hits, not REST calls
+    await asyncio.gather(*(g.chunk(cache=True) for g in bot.guilds if not g.chunked), return_exceptions=True)
     for g in bot.guilds:
         await ensure_named_role(g, "Sore Finger")
         await ensure_named_role(g, "Top Gifter")